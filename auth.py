@@ -1,7 +1,12 @@
 import os
+import time
+import hashlib
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from datetime import datetime, timedelta
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
@@ -9,18 +14,37 @@ from passlib.context import CryptContext
 SECRET_KEY = "your-secret-key-here"  # In production, use a secure secret key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_TTL_SECONDS = 30
+LOGIN_CACHE_TTL_SECONDS = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__memory_cost=46080,
+    argon2__time_cost=1,
+    argon2__parallelism=1,
+)
 
 # Sample user database - In production, use a real database
 USERS_DB = {
     "admin": {
         "username": "admin",
-        "hashed_password": pwd_context.hash("password123"),
+        # Precomputed Argon2id hash of "password123" (m=46080, t=1, p=1, matching
+        # pwd_context) so import does no hashing work
+        "hashed_password": "$argon2id$v=19$m=46080,t=1,p=1$vHx+6s9TojAQURO+MVxj/w$cxRP+dpf2fVvTIAjrSrvhHh84oJIYCRvAmEU5qHFI+Q",
         "disabled": False
     }
 }
 
+# TTLCache is not thread-safe and these are used from worker threads
+_cache_lock = threading.Lock()
+
+# Decoded token payloads, keyed by a SHA-256 prefix of the raw token
+_jwt_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Successful logins, keyed by (username, SHA-256 prefix of the password)
+_login_cache = TTLCache(maxsize=1000, ttl=LOGIN_CACHE_TTL_SECONDS)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -34,17 +58,43 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def verify_token(token: str) -> Optional[dict]:
+    key = hashlib.sha256(token.encode()).digest()[:16]
+    with _cache_lock:
+        payload = _jwt_cache.get(key)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        with _cache_lock:
+            _jwt_cache[key] = payload
+    # A cached payload may outlive the token itself
+    if payload.get("exp", 0) < time.time():
+        with _cache_lock:
+            _jwt_cache.pop(key, None)
+        return None
+    return payload
+
+@lru_cache(maxsize=128)
 def get_user(username: str):
     if username in USERS_DB:
         return USERS_DB[username]
     return None
 
 def authenticate_user(username: str, password: str):
+    key = (username, hashlib.sha256(password.encode()).digest()[:16])
+    with _cache_lock:
+        user = _login_cache.get(key)
+    if user is not None:
+        return user
     user = get_user(username)
     if not user:
         return False
     if not verify_password(password, user["hashed_password"]):
         return False
+    with _cache_lock:
+        _login_cache[key] = user
     return user
 
 class Config:
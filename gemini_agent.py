@@ -7,8 +7,8 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 
 
-def call_gemini_api(text, domain):
-    prompt = f"""
+def _build_prompt(text, domain):
+    return f"""
     You are an AI agent for legal data entry automation.
     Domain: {domain}
     Task: Extract, validate, and standardize key entities from the following legal document text.
@@ -17,6 +17,15 @@ def call_gemini_api(text, domain):
     Text:
     {text}
     """
+
+
+def call_gemini_api(text, domain):
+    model = genai.GenerativeModel('gemini-pro')
+    response = model.generate_content(_build_prompt(text, domain))
+    return response.text
+
+
+async def call_gemini_api_async(text, domain):
     model = genai.GenerativeModel('gemini-pro')
-    response = model.generate_content(prompt)
+    response = await model.generate_content_async(_build_prompt(text, domain))
     return response.text
@@ -1,36 +1,150 @@
 from docx import Document
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, BinaryIO, Tuple
+import orjson
+import csv
 import hashlib
+import os
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
-import pandas as pd
 from docx.document import Document as DocxDocument
 from docx.table import Table
 import re
 from schemas import DocumentType, ValidationStatus, DocumentExtraction
+from auth import Config
+
+try:
+    import ahocorasick
+except ImportError:  # Optional: fall back to per-keyword substring scans
+    ahocorasick = None
+
+try:
+    from blake3 import blake3
+except ImportError:  # Optional: fall back to hashlib SHA-256
+    blake3 = None
+
+COPY_BUFFER_SIZE = 1024 * 1024  # 1MiB
+METADATA_READ_WORKERS = 8
+HASH_ALGORITHM = "blake3" if blake3 else "sha256"
+EXTRACTION_CACHE_SIZE = 128
+# Bump whenever the analyzers change so stale .extract.json sidecars are ignored
+EXTRACTION_FORMAT_VERSION = 2
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File size exceeds maximum limit of {max_size // (1024 * 1024)}MB")
+
+def copy_stream(src: BinaryIO, dst: BinaryIO, max_size: Optional[int] = None) -> int:
+    """Copy src to dst in COPY_BUFFER_SIZE chunks, enforcing max_size as it goes."""
+    written = 0
+    while chunk := src.read(COPY_BUFFER_SIZE):
+        written += len(chunk)
+        if max_size is not None and written > max_size:
+            raise FileTooLargeError(max_size)
+        dst.write(chunk)
+    return written
+
+def _sidecar_path(file_path: str, kind: str) -> Path:
+    """Path of a JSON sidecar stored next to a document, e.g. lease.docx.extract.json."""
+    return Path(f"{file_path}.{kind}.json")
+
+# Signature block indicators, compiled into a single alternation
+SIGNATURE_INDICATORS = (
+    "signature",
+    "signed by",
+    "authorized signatory",
+    "in witness whereof"
+)
+SIG_RE = re.compile("|".join(map(re.escape, SIGNATURE_INDICATORS)))
+
+# Document classification rules
+CLASSIFICATION_RULES = {
+    DocumentType.LEASE: frozenset(("lease", "tenant", "landlord", "rent", "property")),
+    DocumentType.LOAN: frozenset(("loan", "borrower", "lender", "interest rate", "principal")),
+    DocumentType.MSA: frozenset(("services", "statement of work", "sla", "deliverables"))
+}
+
+def _build_keyword_automaton():
+    """Build a single Aho-Corasick automaton over all classification keywords."""
+    automaton = ahocorasick.Automaton()
+    for doc_type, keywords in CLASSIFICATION_RULES.items():
+        for keyword in keywords:
+            automaton.add_word(keyword, (doc_type, keyword))
+    automaton.make_automaton()
+    return automaton
 
 class DocumentProcessor:
+    _keyword_automaton = _build_keyword_automaton() if ahocorasick else None
+
     def __init__(self, upload_dir: Path):
         self.upload_dir = upload_dir
         self.upload_dir.mkdir(exist_ok=True)
 
     def extract_text_from_word(self, file_path: str) -> Dict[str, Any]:
         """Extract structured data from Word document."""
+        try:
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        except OSError as e:
+            raise ValueError(f"Error processing Word document: {str(e)}")
+        return _cached_extraction(str(file_path), mtime_ns)
+
+    @classmethod
+    def _load_or_parse(cls, file_path: str, mtime_ns: int) -> Dict[str, Any]:
+        """Return the extraction for a given file version, persisted next to the file."""
+        extract_path = _sidecar_path(file_path, "extract")
+        source = Path(file_path).name
+        try:
+            with open(extract_path, 'rb') as f:
+                cached = orjson.loads(f.read())
+            if (cached["version"] == EXTRACTION_FORMAT_VERSION
+                    and cached["source"] == source
+                    and cached["mtime_ns"] == mtime_ns):
+                extraction = cached["extraction"]
+                extraction["document_type"] = DocumentType(extraction["document_type"])
+                return extraction
+        except (OSError, KeyError, ValueError):
+            pass
+        
+        extraction = cls._parse_word_document(file_path)
+        try:
+            with open(extract_path, 'wb') as f:
+                f.write(orjson.dumps({
+                    "version": EXTRACTION_FORMAT_VERSION,
+                    "source": source,
+                    "mtime_ns": mtime_ns,
+                    "extraction": extraction
+                }))
+        except OSError:
+            pass
+        return extraction
+
+    @classmethod
+    def _parse_word_document(cls, file_path: str) -> Dict[str, Any]:
+        """Parse a Word document and run all analyzers over it."""
         try:
             doc: DocxDocument = Document(file_path)
             
+            # Walk the document body once and reuse the paragraphs below
+            paragraphs = cls._iter_paragraphs(doc)
+            
             # Extract text with section markers
-            sections = self._extract_sections(doc)
+            sections = cls._extract_sections(paragraphs)
             
             # Extract tables
-            tables = self._extract_tables(doc)
+            tables = cls._extract_tables(doc)
+            
+            # Lowercase the document once and share it between analyzers
+            lower_text, paragraph_starts = cls._lowercase_text(paragraphs)
             
             # Extract signatures
-            signatures = self._detect_signatures(doc)
+            signatures = cls._detect_signatures(lower_text, paragraph_starts)
             
             # Identify document type
-            doc_type = self._classify_document(sections)
+            doc_type = cls._classify_document(lower_text)
             
             return {
                 "sections": sections,
@@ -41,19 +155,36 @@ class DocumentProcessor:
         except Exception as e:
             raise ValueError(f"Error processing Word document: {str(e)}")
 
-    def _extract_sections(self, doc: DocxDocument) -> Dict[str, str]:
+    @staticmethod
+    def _iter_paragraphs(doc: DocxDocument) -> List[Tuple[str, str]]:
+        """Materialize (style name, text) pairs for every paragraph."""
+        return [(p.style.name, p.text) for p in doc.paragraphs]
+
+    @staticmethod
+    def _lowercase_text(paragraphs: List[Tuple[str, str]]) -> Tuple[str, List[int]]:
+        """Join paragraphs into one lowercase buffer and record where each one starts."""
+        lows = [text.lower() for _, text in paragraphs]
+        starts = []
+        offset = 0
+        for low in lows:
+            starts.append(offset)
+            offset += len(low) + 1
+        return "\n".join(lows), starts
+
+    @staticmethod
+    def _extract_sections(paragraphs: List[Tuple[str, str]]) -> Dict[str, str]:
         """Extract document sections based on headings and structure."""
         sections = {}
         current_section = "header"
         current_text = []
 
-        for para in doc.paragraphs:
-            text = para.text.strip()
+        for style_name, text in paragraphs:
+            text = text.strip()
             if not text:
                 continue
 
             # Check if this is a heading
-            if para.style.name.startswith('Heading'):
+            if style_name.startswith('Heading'):
                 if current_text:
                     sections[current_section] = '\n'.join(current_text)
                 current_section = text.lower().replace(' ', '_')
@@ -67,19 +198,19 @@ class DocumentProcessor:
 
         return sections
 
-    def _extract_tables(self, doc: DocxDocument) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _extract_tables(doc: DocxDocument) -> List[Dict[str, Any]]:
         """Extract and structure tables from the document."""
         tables = []
         for table in doc.tables:
             try:
-                # Convert table to DataFrame
                 data = [[cell.text for cell in row.cells] for row in table.rows]
-                df = pd.DataFrame(data[1:], columns=data[0])
+                headers = data[0]
                 
-                # Convert DataFrame to dict
+                # Convert rows to header-keyed records
                 table_dict = {
-                    "headers": data[0],
-                    "data": df.to_dict('records'),
+                    "headers": headers,
+                    "data": [dict(zip(headers, row)) for row in data[1:]],
                     "location": f"Table {len(tables) + 1}"
                 }
                 tables.append(table_dict)
@@ -87,43 +218,35 @@ class DocumentProcessor:
                 continue
         return tables
 
-    def _detect_signatures(self, doc: DocxDocument) -> Dict[str, bool]:
+    @staticmethod
+    def _detect_signatures(lower_text: str, paragraph_starts: List[int]) -> Dict[str, bool]:
         """Detect signature blocks and validate their presence."""
-        signature_indicators = [
-            r"signature",
-            r"signed by",
-            r"authorized signatory",
-            r"in witness whereof"
-        ]
-        
-        text = "\n".join([p.text.lower() for p in doc.paragraphs])
+        # Find signature locations by mapping each match back to its paragraph
+        locations = []
+        last_index = -1
+        for match in SIG_RE.finditer(lower_text):
+            index = bisect_right(paragraph_starts, match.start()) - 1
+            if index != last_index:
+                locations.append(f"Paragraph {index + 1}")
+                last_index = index
         
-        signatures = {
-            "has_signature_block": any(re.search(pattern, text) for pattern in signature_indicators),
-            "signature_locations": []
+        return {
+            "has_signature_block": bool(locations),
+            "signature_locations": locations
         }
-        
-        # Find signature locations
-        for i, para in enumerate(doc.paragraphs):
-            if any(re.search(pattern, para.text.lower()) for pattern in signature_indicators):
-                signatures["signature_locations"].append(f"Paragraph {i + 1}")
-        
-        return signatures
 
-    def _classify_document(self, sections: Dict[str, str]) -> DocumentType:
-        """Classify document type based on content analysis."""
-        text = " ".join(sections.values()).lower()
-        
-        # Define classification rules
-        rules = {
-            DocumentType.LEASE: ["lease", "tenant", "landlord", "rent", "property"],
-            DocumentType.LOAN: ["loan", "borrower", "lender", "interest rate", "principal"],
-            DocumentType.MSA: ["services", "statement of work", "sla", "deliverables"]
-        }
-        
-        # Score each document type
-        scores = {doc_type: sum(1 for keyword in keywords if keyword in text)
-                 for doc_type, keywords in rules.items()}
+    @classmethod
+    def _classify_document(cls, text: str) -> DocumentType:
+        """Classify document type based on content analysis of lowercased text."""
+        # Score each document type by the number of distinct keywords present
+        scores = {doc_type: 0 for doc_type in CLASSIFICATION_RULES}
+        if cls._keyword_automaton is not None:
+            matched = {value for _, value in cls._keyword_automaton.iter(text)}
+            for doc_type, _ in matched:
+                scores[doc_type] += 1
+        else:
+            for doc_type, keywords in CLASSIFICATION_RULES.items():
+                scores[doc_type] = sum(1 for keyword in keywords if keyword in text)
         
         # Return the type with highest score
         return max(scores.items(), key=lambda x: x[1])[0]
@@ -150,106 +273,171 @@ class DocumentProcessor:
         
         return validations
 
-    def save_document(self, file_content: bytes, filename: str) -> Dict[str, str]:
+    def save_document(self, file_stream: BinaryIO, filename: str) -> Dict[str, str]:
         """Save document with metadata and validation."""
         try:
-            # Generate unique filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Generate unique filename; one timestamp keeps filename and metadata consistent
+            now = datetime.now()
+            timestamp = now.strftime("%Y%m%d_%H%M%S")
             safe_filename = f"{timestamp}_{self._sanitize_filename(filename)}"
             file_path = self.upload_dir / safe_filename
             
-            # Save file
-            with open(file_path, "wb") as f:
-                f.write(file_content)
+            # Stream file to disk
+            try:
+                with open(file_path, "wb") as f:
+                    file_size = copy_stream(file_stream, f, max_size=Config.MAX_FILE_SIZE)
+            except FileTooLargeError:
+                file_path.unlink(missing_ok=True)
+                raise
+            
+            # Hash the saved file
+            file_hash = self._calculate_hash(file_path)
             
             # Generate metadata
             metadata = {
-                "document_id": self._generate_document_id(file_content),
+                "document_id": self._generate_document_id(file_hash),
                 "original_filename": filename,
                 "saved_filename": safe_filename,
-                "upload_time": datetime.now().isoformat(),
-                "file_size": len(file_content),
-                "file_hash": self._calculate_hash(file_content),
+                "upload_time": now.isoformat(),
+                "file_size": file_size,
+                "file_hash": file_hash,
+                "hash_algorithm": HASH_ALGORITHM,
                 "processing_status": "pending"
             }
             
             # Save metadata
-            meta_path = file_path.with_suffix('.meta.json')
-            with open(meta_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            meta_path = _sidecar_path(file_path, "meta")
+            with open(meta_path, 'wb') as f:
+                f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
             
             return metadata
+        except FileTooLargeError:
+            raise
         except Exception as e:
             raise ValueError(f"Error saving document: {str(e)}")
 
+    def save_analysis(self, file_path: str, domain: str, result: str) -> Tuple[Dict[str, Any], str]:
+        """Persist an analysis result next to its document and return it with its ETag."""
+        analysis = {
+            "source": Path(file_path).name,
+            "mtime_ns": os.stat(file_path).st_mtime_ns,
+            "domain": domain,
+            "result": result
+        }
+        data = orjson.dumps(analysis)
+        with open(_sidecar_path(file_path, "analysis"), 'wb') as f:
+            f.write(data)
+        return analysis, hashlib.sha256(data).hexdigest()
+
+    def load_analysis(self, file_path: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Load the analysis of the current version of a document, if there is one."""
+        try:
+            mtime_ns = os.stat(file_path).st_mtime_ns
+            with open(_sidecar_path(file_path, "analysis"), 'rb') as f:
+                data = f.read()
+            analysis = orjson.loads(data)
+            # An analysis of an earlier version of the file is stale
+            if analysis["source"] != Path(file_path).name or analysis["mtime_ns"] != mtime_ns:
+                return None
+            return analysis, hashlib.sha256(data).hexdigest()
+        except (OSError, KeyError, ValueError):
+            return None
+
     def get_document_list(self) -> List[Dict[str, Any]]:
         """Get list of documents with metadata and processing status."""
-        documents = []
-        for meta_file in self.upload_dir.glob("*.meta.json"):
-            try:
-                with open(meta_file, 'r') as f:
-                    metadata = json.load(f)
-                doc_path = meta_file.with_suffix('').with_suffix('.docx')
-                analysis_path = meta_file.with_suffix('.analysis.json')
-                
-                if doc_path.exists():
-                    metadata["exists"] = True
-                    metadata["path"] = str(doc_path)
-                    metadata["has_analysis"] = analysis_path.exists()
-                    if metadata["has_analysis"]:
-                        with open(analysis_path, 'r') as f:
-                            analysis = json.load(f)
-                            metadata["validation_summary"] = analysis.get("validation_results", {})
-                    documents.append(metadata)
-            except Exception:
-                continue
+        with os.scandir(self.upload_dir) as it:
+            meta_paths = [entry.path for entry in it if entry.name.endswith('.meta.json')]
+        
+        with ThreadPoolExecutor(max_workers=METADATA_READ_WORKERS) as executor:
+            documents = [doc for doc in executor.map(self._load_metadata, meta_paths) if doc is not None]
         return sorted(documents, key=lambda x: x["upload_time"], reverse=True)
 
+    def _load_metadata(self, meta_path: str) -> Optional[Dict[str, Any]]:
+        """Load a document's metadata, or None if it is unreadable or orphaned."""
+        try:
+            with open(meta_path, 'rb') as f:
+                metadata = orjson.loads(f.read())
+            doc_path = self.upload_dir / metadata["saved_filename"]
+            
+            if not doc_path.exists():
+                return None
+            metadata["exists"] = True
+            metadata["path"] = str(doc_path)
+            stored = self.load_analysis(str(doc_path))
+            metadata["has_analysis"] = stored is not None
+            if stored is not None:
+                analysis, _ = stored
+                metadata["analysis_domain"] = analysis.get("domain")
+            return metadata
+        except Exception:
+            return None
+
     def export_to_csv(self, document_id: str) -> str:
         """Export document analysis to CSV."""
         try:
             analysis_path = next(self.upload_dir.glob(f"*{document_id}*.analysis.json"))
-            with open(analysis_path, 'r') as f:
-                analysis = json.load(f)
+            with open(analysis_path, 'rb') as f:
+                analysis = orjson.loads(f.read())
             
             # Convert nested JSON to flat structure
             flat_data = self._flatten_json(analysis)
-            df = pd.DataFrame([flat_data])
             
             # Save to CSV
             csv_path = analysis_path.with_suffix('.csv')
-            df.to_csv(csv_path, index=False)
+            with open(csv_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(flat_data))
+                writer.writeheader()
+                writer.writerow(flat_data)
             return str(csv_path)
         except Exception as e:
             raise ValueError(f"Error exporting to CSV: {str(e)}")
 
     def _flatten_json(self, nested_json: Dict, parent_key: str = '', sep: str = '_') -> Dict:
         """Flatten nested JSON structure."""
-        items = []
-        for k, v in nested_json.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(self._flatten_json(v, new_key, sep).items())
+        flat = {}
+        stack = [(parent_key, nested_json)]
+        while stack:
+            key, value = stack.pop()
+            if isinstance(value, dict):
+                # Push in reverse so keys come out in their original order
+                for k, v in reversed(value.items()):
+                    stack.append((f"{key}{sep}{k}" if key else k, v))
             else:
-                items.append((new_key, v))
-        return dict(items)
+                flat[key] = value
+        return flat
 
-    def _generate_document_id(self, content: bytes) -> str:
-        """Generate unique document ID."""
-        return hashlib.sha256(content).hexdigest()[:12]
+    def _generate_document_id(self, file_hash: str) -> str:
+        """Generate unique document ID from the file's content hash."""
+        return file_hash[:12]
 
     def _sanitize_filename(self, filename: str) -> str:
         """Sanitize filename for safe storage."""
         return "".join(c for c in filename if c.isalnum() or c in "._- ")
 
-    def _calculate_hash(self, content: bytes) -> str:
-        """Calculate SHA-256 hash of file content."""
-        return hashlib.sha256(content).hexdigest()
+    def _calculate_hash(self, file_path: Path) -> str:
+        """Calculate the content hash of a file (BLAKE3, or SHA-256 without blake3)."""
+        if blake3 is not None:
+            hasher = blake3(max_threads=blake3.AUTO)
+            hasher.update_mmap(file_path)
+            return hasher.hexdigest()
+        with open(file_path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
 
-    def validate_file(self, filename: str, content: bytes) -> None:
+    def validate_file(self, filename: str) -> None:
         """Validate file before processing."""
         if not filename.lower().endswith(('.doc', '.docx')):
             raise ValueError("Only Word documents (.doc, .docx) are supported")
-        
-        if len(content) > 10 * 1024 * 1024:  # 10MB limit
-            raise ValueError("File size exceeds maximum limit of 10MB")
+
+@lru_cache(maxsize=EXTRACTION_CACHE_SIZE)
+def _cached_extraction(file_path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Extraction for one file version, shared by every DocumentProcessor."""
+    return DocumentProcessor._load_or_parse(file_path, mtime_ns)
+
+def extract_document(file_path: str) -> Dict[str, Any]:
+    """Extract a Word document; module-level so process pools can pickle it."""
+    # Skip DocumentProcessor.__init__, which would create the file's directory
+    try:
+        mtime_ns = os.stat(file_path).st_mtime_ns
+    except OSError as e:
+        raise ValueError(f"Error processing Word document: {str(e)}")
+    return _cached_extraction(str(file_path), mtime_ns)
@@ -1,74 +1,192 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Form, UploadFile, File
+from fastapi import APIRouter, FastAPI, Request, Depends, HTTPException, status, Form, UploadFile, File
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import os
 import json
+import asyncio
+import threading
+import multiprocessing
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
+from cachetools import cached, TTLCache
 
-from auth import authenticate_user, create_access_token, Config
-from utils import DocumentProcessor
-from gemini_agent import analyze_document
+from auth import authenticate_user, create_access_token, verify_token, get_user, Config, ACCESS_TOKEN_EXPIRE_MINUTES
+from utils import DocumentProcessor, FileTooLargeError, extract_document
+from gemini_agent import call_gemini_api_async
 
 # Initialize FastAPI app
 app = FastAPI(title="Legal Document Analysis System")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Worker processes for parsing several documents at once. Spawned rather than
+    # forked because the server process already runs threads; they start on demand.
+    pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    app.state.extract_pool = pool
+    try:
+        yield
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+router = APIRouter(lifespan=lifespan)
+
+UPLOAD_DIR = Config.UPLOAD_DIR
+
 # Initialize document processor
-doc_processor = DocumentProcessor(Config.UPLOAD_DIR)
+doc_processor = DocumentProcessor(UPLOAD_DIR)
 
 # Setup templates and static files
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # OAuth2 scheme for token authentication
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 # Initialize directories
 Config.init_dirs()
 
+# Short-lived listing cache; upload_file clears it so new files show up immediately
+_doc_list_cache = TTLCache(maxsize=1, ttl=2)
+_doc_list_lock = threading.Lock()
+
+@cached(_doc_list_cache, lock=_doc_list_lock)
+def list_uploaded_docs():
+    return doc_processor.get_document_list()
+
+def issue_access_token(username: str) -> str:
+    return create_access_token({"sub": username}, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    # Browser sessions carry the token in the cookie set by /login
+    token = token or request.cookies.get("access_token")
+    if token is None:
+        raise credentials_exception
+    payload = verify_token(token)
+    if payload is None:
+        raise credentials_exception
+    user = get_user(payload.get("sub"))
+    if user is None or user["disabled"]:
+        raise credentials_exception
+    return user
+
 @router.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return templates.TemplateResponse(request, "login.html")
 
 @router.post("/login")
-def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    if authenticate_user(username, password):
+async def login(request: Request, username: str = Form(...), password: str = Form(...)):
+    # Password hashing is CPU-bound; keep it off the event loop
+    if await asyncio.to_thread(authenticate_user, username, password):
         response = RedirectResponse(url="/upload", status_code=302)
         response.set_cookie(key="user", value=username)
+        response.set_cookie(
+            key="access_token",
+            value=issue_access_token(username),
+            max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+            httponly=True,
+            samesite="lax",
+        )
         return response
-    return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+    return templates.TemplateResponse(request, "login.html", {"error": "Invalid credentials"})
+
+@router.post("/token")
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await asyncio.to_thread(authenticate_user, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return {"access_token": issue_access_token(user["username"]), "token_type": "bearer"}
 
 @router.get("/upload", response_class=HTMLResponse)
-def upload_page(request: Request):
-    docs = os.listdir(UPLOAD_DIR)
-    return templates.TemplateResponse("upload.html", {"request": request, "docs": docs})
+def upload_page(request: Request, user: dict = Depends(get_current_user)):
+    documents = list_uploaded_docs()
+    return templates.TemplateResponse(request, "upload.html", {"documents": documents})
 
 @router.post("/upload")
-def upload_file(request: Request, file: UploadFile = File(...)):
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
+async def upload_file(request: Request, file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    try:
+        doc_processor.validate_file(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    try:
+        # Reject from the declared file size before touching the disk. Content-Length
+        # is not used: it covers the whole multipart body, boundaries included.
+        if file.size is not None and file.size > Config.MAX_FILE_SIZE:
+            raise FileTooLargeError(Config.MAX_FILE_SIZE)
+        # Streams to disk, enforces the size cap and hashes in one place
+        await asyncio.to_thread(doc_processor.save_document, file.file, file.filename)
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e))
+    with _doc_list_lock:
+        _doc_list_cache.clear()
     return RedirectResponse(url="/upload", status_code=302)
 
 @router.get("/review/{filename}", response_class=HTMLResponse)
-def review_page(request: Request, filename: str):
+async def review_page(request: Request, filename: str, user: dict = Depends(get_current_user)):
     file_path = os.path.join(UPLOAD_DIR, filename)
-    text = extract_text_from_word(file_path)
-    return templates.TemplateResponse("review.html", {"request": request, "filename": filename, "text": text})
+    text = await asyncio.to_thread(doc_processor.extract_text_from_word, file_path)
+    return templates.TemplateResponse(request, "review.html", {"filename": filename, "text": text})
+
+@router.post("/analyze/batch")
+async def analyze_batch(request: Request, filenames: List[str] = Form(...), user: dict = Depends(get_current_user)):
+    loop = asyncio.get_running_loop()
+    pool = request.app.state.extract_pool
+    # Each file is parsed once and keyed once in the response
+    filenames = list(dict.fromkeys(filenames))
+    upload_root = UPLOAD_DIR.resolve()
+    for filename in filenames:
+        # Only bare names of files inside UPLOAD_DIR may be handed to the pool
+        if (filename in ("", ".", "..") or os.path.basename(filename) != filename
+                or (upload_root / filename).resolve().parent != upload_root):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid filename: {filename}")
+    file_paths = [os.path.join(UPLOAD_DIR, filename) for filename in filenames]
+    results = await asyncio.gather(
+        *(loop.run_in_executor(pool, extract_document, file_path) for file_path in file_paths),
+        return_exceptions=True,
+    )
+    return JSONResponse({
+        filename: {"error": str(result)} if isinstance(result, Exception) else result
+        for filename, result in zip(filenames, results)
+    })
 
 @router.post("/analyze/{filename}")
-def analyze_file(request: Request, filename: str, domain: str = Form(...)):
+async def analyze_file(request: Request, filename: str, domain: str = Form(...), user: dict = Depends(get_current_user)):
     file_path = os.path.join(UPLOAD_DIR, filename)
-    text = extract_text_from_word(file_path)
-    result = call_gemini_api(text, domain)
+    text = await asyncio.to_thread(doc_processor.extract_text_from_word, file_path)
+    result = await call_gemini_api_async(text, domain)
+    await asyncio.to_thread(doc_processor.save_analysis, file_path, domain, result)
     return RedirectResponse(url=f"/report/{filename}", status_code=302)
 
 @router.get("/report/{filename}", response_class=HTMLResponse)
-def report_page(request: Request, filename: str):
+async def report_page(request: Request, filename: str, user: dict = Depends(get_current_user)):
     file_path = os.path.join(UPLOAD_DIR, filename)
-    text = extract_text_from_word(file_path)
-    # For demo, call Gemini API with default domain
-    result = call_gemini_api(text, "Finance and tax")
-    return templates.TemplateResponse("report.html", {"request": request, "filename": filename, "result": result})
+    stored = await asyncio.to_thread(doc_processor.load_analysis, file_path)
+    if stored is None:
+        text = await asyncio.to_thread(doc_processor.extract_text_from_word, file_path)
+        # For demo, call Gemini API with default domain
+        domain = "Finance and tax"
+        result = await call_gemini_api_async(text, domain)
+        stored = await asyncio.to_thread(doc_processor.save_analysis, file_path, domain, result)
+    analysis, digest = stored
+    etag = f'"{digest}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response = templates.TemplateResponse(request, "report.html", {"filename": filename, "result": analysis["result"]})
+    response.headers["ETag"] = etag
+    return response